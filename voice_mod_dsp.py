@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+# voice_mod_dsp.py
+# Shared real-time DSP for the voice modulator scripts
+import math
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+
+import numpy as np
+from numba import njit
+from scipy import fft as scipy_fft
+
+try:
+    import pyfftw
+except ImportError:
+    pyfftw = None  # Fall back to scipy FFT
+
+# Effect settings
+CARRIER_FREQ = 95  # Robotic ring modulation carrier (Hz)
+OUTPUT_GAIN = np.float32(2.2)
+OUTPUT_LIMIT = np.float32(0.95)
+
+# Robotic effect constants, float32 so the kernel stays in single precision
+# (Numba freezes module globals into the compiled code)
+ROBOTIC_INTENSITY = np.float32(0.7)
+ROBOTIC_DRY = np.float32(1.0 - 0.7)
+SOFT_CLIP_DRIVE = np.float32(1.2)
+SOFT_CLIP_LEVEL = np.float32(0.9)
+DELAY_WINDOW = 512  # Delay-line pitch shift crossfade window (~11ms at 48kHz, ~5ms average delay)
+RING_BLOCKS = 8  # Blocks in flight between the audio callback and the worker thread
+BIN_MAP_CACHE_SIZE = 8  # Pitch settings whose vocoder bin maps stay cached
+GATE_ENERGY = 1e-6  # Mean square below which a block counts as silent (~-60 dBFS)
+GATE_HOLD = 0.1  # Seconds of processing kept after input goes silent
+
+# Pre-compute carrier wave table for robotic effect (optimization)
+carrier_table_size = 8192  # One period; power of two for bitmask indexing
+carrier_table = np.sin(2 * np.pi * np.arange(carrier_table_size) / carrier_table_size).astype(np.float32)
+
+# Cached FFTW plans keyed by FFT length, shared by every stream (optimization)
+fft_plans = {}
+
+# Vocoder bin maps keyed by (semitones, frame size), least recently used first
+bin_maps = OrderedDict()
+
+@dataclass
+class State:
+    """Settings, effect state and scratch buffers for one duplex stream"""
+    block_size: int
+    sample_rate: int = 48000
+    pitch: float = 3.0
+    robotic_enabled: bool = True
+    muted: bool = False
+    pitch_method: str = 'vocoder'  # 'vocoder' (STFT) or 'delay' (time-domain, no FFT)
+    threaded: bool = False  # Process on a worker thread (adds one block of latency)
+    carrier_phase: int = 0  # 32-bit DDS phase accumulator
+    gate_hold: int = 0  # Blocks left before the energy gate closes
+    
+    def __post_init__(self):
+        # The top 13 bits of the carrier phase index the table
+        self.carrier_step = int(round(CARRIER_FREQ / self.sample_rate * 2 ** 32))
+        
+        # Phase vocoder: 4x overlap STFT with one block per analysis frame
+        self.frame_size = self.block_size
+        self.hop_size = self.frame_size // 4
+        fft_bins = self.frame_size // 2 + 1
+        self.window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(self.frame_size) / self.frame_size)).astype(np.float32)
+        self.ola_gain = 1.0 / 1.5  # Periodic Hann squared sums to 1.5 at 4x overlap
+        self.hop_phase = 2 * np.pi * self.hop_size / self.frame_size  # Expected phase advance of bin 1 per hop
+        self.in_fifo = np.zeros(self.frame_size, dtype=np.float32)
+        self.out_accum = np.zeros(self.frame_size, dtype=np.float32)
+        self.last_phase = np.zeros(fft_bins)
+        self.sum_phase = np.zeros(fft_bins)
+        self.shift_magnitude = np.zeros(fft_bins)
+        self.shift_freq = np.zeros(fft_bins)
+        
+        # Delay-line pitch shift: input ring buffer and read tap position
+        self.delay_buf = np.zeros(2 * DELAY_WINDOW, dtype=np.float32)
+        self.delay_write = 0
+        self.delay = 0.0
+        
+        # Energy gate hold, at least long enough to drain the vocoder overlap
+        # and the delay line so phrase tails are never cut
+        self.gate_hold_blocks = max(math.ceil(GATE_HOLD * self.sample_rate / self.block_size),
+                                    2 + DELAY_WINDOW // self.block_size)
+        
+        # Preallocated scratch buffers so the audio callback never allocates
+        self.frame_buf = np.zeros(self.frame_size, dtype=np.float32)
+        self.spectrum_buf = np.zeros(fft_bins, dtype=np.complex64)
+        self.shifted_buf = np.zeros(self.block_size, dtype=np.float32)
+        self.robotic_out = np.zeros(self.block_size, dtype=np.float32)
+        
+        # Plan for the stream block size at startup, not inside the audio callback
+        if pyfftw is not None:
+            get_fft_plans(self.frame_size)
+        
+        # Worker thread: blocks travel through preallocated slots, and two
+        # single-producer/single-consumer queues carry the slot numbers
+        if self.threaded:
+            self.in_blocks = np.zeros((RING_BLOCKS, self.block_size, 1), dtype=np.float32)
+            self.out_blocks = np.zeros((RING_BLOCKS, self.block_size, 2), dtype=np.float32)
+            self.next_slot = 0
+            self.in_ring = deque(maxlen=RING_BLOCKS)
+            self.out_ring = deque(maxlen=RING_BLOCKS)
+            self.block_ready = threading.Event()
+            threading.Thread(target=self.process_loop, daemon=True).start()
+    
+    def callback(self, indata, outdata, frames, time_info, status):
+        """sounddevice duplex stream callback"""
+        if status:
+            pass  # Ignore status messages for performance
+        
+        if not self.threaded:
+            process_block(indata, outdata, frames, self)
+            return
+        
+        # Hand this block to the worker
+        slot = self.next_slot
+        self.next_slot = (slot + 1) % RING_BLOCKS
+        self.in_blocks[slot, :frames] = indata[:, :1]
+        self.in_ring.append(slot)
+        self.block_ready.set()
+        
+        # Play the newest finished block (silence if the worker fell behind);
+        # older ones left over from a stall are dropped so latency returns to
+        # one block instead of growing
+        while len(self.out_ring) > 1:
+            self.out_ring.popleft()
+        if self.out_ring:
+            outdata[:] = self.out_blocks[self.out_ring.popleft(), :frames]
+        else:
+            outdata.fill(0)
+    
+    def process_loop(self):
+        """Worker thread: run the DSP on blocks queued by the callback"""
+        while True:
+            self.block_ready.wait()
+            self.block_ready.clear()
+            while self.in_ring:
+                slot = self.in_ring.popleft()
+                process_block(self.in_blocks[slot], self.out_blocks[slot], self.block_size, self)
+                self.out_ring.append(slot)
+
+def get_fft_plans(n):
+    """Get (forward, inverse) FFTW plans for length n, planning on first use"""
+    if n not in fft_plans:
+        fft_in = pyfftw.empty_aligned(n, dtype='float32')
+        fft_out = pyfftw.empty_aligned(n // 2 + 1, dtype='complex64')
+        ifft_in = pyfftw.empty_aligned(n // 2 + 1, dtype='complex64')
+        ifft_out = pyfftw.empty_aligned(n, dtype='float32')
+        fft_plans[n] = (
+            pyfftw.FFTW(fft_in, fft_out, flags=('FFTW_MEASURE',), threads=1),
+            pyfftw.FFTW(ifft_in, ifft_out, direction='FFTW_BACKWARD',
+                        flags=('FFTW_MEASURE',), threads=1),
+        )
+    return fft_plans[n]
+
+def get_bin_map(semitones, n):
+    """Get the analysis to synthesis bin map for a pitch shift, computing on a miss"""
+    key = (semitones, n)
+    if key in bin_maps:
+        bin_maps.move_to_end(key)
+        return bin_maps[key]
+    
+    # Analysis bin k moves to synthesis bin k * ratio (dropped if past the top)
+    ratio = 2.0 ** (semitones / 12.0)
+    bin_maps[key] = (np.arange(n // 2 + 1) * ratio).astype(np.intp)
+    if len(bin_maps) > BIN_MAP_CACHE_SIZE:
+        bin_maps.popitem(last=False)
+    return bin_maps[key]
+
+def rfft(audio):
+    """Real FFT using the cached FFTW plan"""
+    if pyfftw is None:
+        # scipy keeps float32 input in single precision (numpy upcasts)
+        return scipy_fft.rfft(audio, overwrite_x=True)
+    forward, _ = get_fft_plans(len(audio))
+    forward.input_array[:] = audio
+    return forward()
+
+def irfft(spectrum, n):
+    """Inverse real FFT using the cached FFTW plan"""
+    if pyfftw is None:
+        return scipy_fft.irfft(spectrum, n=n, overwrite_x=True)
+    _, inverse = get_fft_plans(n)
+    inverse.input_array[:] = spectrum
+    return inverse()
+
+@njit(cache=True, fastmath=True, nogil=True, boundscheck=False)
+def vocoder_kernel(spectrum, new_freq_idx, ratio, hop_phase, last_phase, sum_phase,
+                   magnitude, freq, out):
+    """Phase vocoder analysis, bin shift and phase propagation for one frame"""
+    n = spectrum.shape[0]
+    magnitude[:] = 0.0
+    freq[:] = 0.0
+    
+    for k in range(n):
+        # Analysis: magnitude and true frequency (in bins) from the phase advance
+        re = spectrum[k].real
+        im = spectrum[k].imag
+        phase = math.atan2(im, re)
+        delta = phase - last_phase[k] - k * hop_phase
+        last_phase[k] = phase
+        delta -= 2 * math.pi * math.floor(delta / (2 * math.pi) + 0.5)
+        
+        # Shift bins by the pitch ratio
+        index = new_freq_idx[k]
+        if index < n:
+            magnitude[index] += math.sqrt(re * re + im * im)
+            freq[index] = (k + delta / hop_phase) * ratio
+    
+    for k in range(n):
+        # Synthesis: propagate each bin's phase at its shifted frequency
+        phase = (sum_phase[k] + freq[k] * hop_phase) % (2 * math.pi)
+        sum_phase[k] = phase
+        out[k] = complex(magnitude[k] * math.cos(phase), magnitude[k] * math.sin(phase))
+
+@njit(cache=True, fastmath=True, nogil=True, boundscheck=False)
+def overlap_add_kernel(frame, window, accum, gain, out):
+    """Overlap-add one synthesis frame and emit the finished hop"""
+    n = frame.shape[0]
+    hop = out.shape[0]
+    for i in range(n):
+        accum[i] += frame[i] * window[i]
+    for i in range(hop):
+        out[i] = accum[i] * gain
+    for i in range(n - hop):
+        accum[i] = accum[i + hop]
+    for i in range(n - hop, n):
+        accum[i] = 0.0
+
+def pitch_shift_fast(audio, semitones, state):
+    """Pitch shift using an overlap-add phase vocoder"""
+    if abs(semitones) < 0.1:
+        return audio
+    
+    # Calculate pitch ratio
+    ratio = 2.0 ** (semitones / 12.0)
+    new_freq_idx = get_bin_map(semitones, state.frame_size)
+    
+    hop = state.hop_size
+    in_fifo = state.in_fifo
+    shifted = state.shifted_buf[:len(audio)]
+    for start in range(0, len(audio), hop):
+        # Slide the next hop of input into the analysis frame
+        in_fifo[:-hop] = in_fifo[hop:]
+        in_fifo[-hop:] = audio[start:start + hop]
+        
+        # Window into scratch, FFT, then the per-bin vocoder work in one compiled call
+        np.multiply(in_fifo, state.window, out=state.frame_buf)
+        spectrum = rfft(state.frame_buf)
+        vocoder_kernel(spectrum, new_freq_idx, ratio, state.hop_phase, state.last_phase,
+                       state.sum_phase, state.shift_magnitude, state.shift_freq,
+                       state.spectrum_buf)
+        frame = irfft(state.spectrum_buf, state.frame_size)
+        
+        # Overlap-add and emit one hop of output
+        overlap_add_kernel(frame, state.window, state.out_accum, state.ola_gain,
+                           shifted[start:start + hop])
+    
+    return shifted
+
+@njit(cache=True, fastmath=True, nogil=True, boundscheck=False)
+def delay_pitch_kernel(audio, ratio, buf, write_pos, delay, window, out):
+    """Two-tap delay-line pitch shift with triangular crossfade between taps"""
+    mask = buf.shape[0] - 1
+    half = window * 0.5
+    for i in range(audio.shape[0]):
+        buf[write_pos] = audio[i]
+        
+        # Two read taps half a window apart; each fades out as it wraps
+        sample = 0.0
+        for tap in range(2):
+            d = delay + tap * half
+            if d >= window:
+                d -= window
+            pos = write_pos - d
+            base = math.floor(pos)
+            frac = pos - base
+            j = int(base)
+            a = buf[j & mask]
+            b = buf[(j + 1) & mask]
+            gain = 1.0 - abs(2.0 * d / window - 1.0)
+            sample += gain * (a + (b - a) * frac)
+        out[i] = sample
+        
+        # Read taps move at the pitch ratio relative to the write head
+        write_pos = (write_pos + 1) & mask
+        delay -= ratio - 1.0
+        if delay < 0.0:
+            delay += window
+        elif delay >= window:
+            delay -= window
+    
+    return write_pos, delay
+
+def pitch_shift_delay(audio, semitones, state):
+    """Time-domain pitch shift using a variable-rate delay line (no FFT)"""
+    if abs(semitones) < 0.1:
+        return audio
+    
+    # Calculate pitch ratio
+    ratio = 2.0 ** (semitones / 12.0)
+    
+    shifted = state.shifted_buf[:len(audio)]
+    state.delay_write, state.delay = delay_pitch_kernel(
+        audio, ratio, state.delay_buf, state.delay_write, state.delay,
+        float(DELAY_WINDOW), shifted)
+    
+    return shifted
+
+@njit(cache=True, fastmath=True, nogil=True)
+def fast_tanh(x):
+    """Rational (Pade 7/6) tanh approximation, max error ~1e-4"""
+    # Saturates at exactly 1.0 around |x| = 4.97; float32 literals keep
+    # float32 input in single precision
+    limit = np.float32(4.97)
+    x = min(max(x, -limit), limit)
+    x2 = x * x
+    return x * (np.float32(135135.0) + x2 * (np.float32(17325.0) + x2 * (np.float32(378.0) + x2))) \
+        / (np.float32(135135.0) + x2 * (np.float32(62370.0) + x2 * (np.float32(3150.0) + np.float32(28.0) * x2)))
+
+@njit(cache=True, fastmath=True, nogil=True, boundscheck=False)
+def robotic_kernel(audio, table, phase, step, out):
+    """Fused ring modulation, bit reduction and soft clipping"""
+    for i in range(audio.shape[0]):
+        # Ring modulation
+        carrier = table[phase >> 19]
+        phase = (phase + step) & 0xFFFFFFFF
+        modulated = audio[i] * carrier * ROBOTIC_INTENSITY + audio[i] * ROBOTIC_DRY
+        
+        # Bit reduction: mask the float32 mantissa down to 12 bits
+        bits = np.uint32(np.float32(modulated).view(np.uint32) & 0xFFFFF800)
+        modulated = bits.view(np.float32)
+        
+        # Soft clipping
+        out[i] = fast_tanh(modulated * SOFT_CLIP_DRIVE) * SOFT_CLIP_LEVEL
+    
+    return phase
+
+def apply_robotic_effect(audio, state):
+    """Apply robotic effect with pre-computed carrier"""
+    # Ring modulation, bit reduction and soft clipping in one pass
+    out = state.robotic_out[:len(audio)]
+    state.carrier_phase = robotic_kernel(audio, carrier_table, state.carrier_phase,
+                                         state.carrier_step, out)
+    
+    return out
+
+@njit(cache=True, fastmath=True, nogil=True, boundscheck=False)
+def boost_clip_stereo(mono, out, gain, limit):
+    """Fused volume boost, clipping and mono to stereo copy"""
+    # Interleaved flat stores let LLVM emit packed min/max and unpack shuffles
+    interleaved = out.reshape(-1)
+    for i in range(mono.shape[0]):
+        sample = min(max(mono[i] * gain, -limit), limit)
+        interleaved[2 * i] = sample
+        interleaved[2 * i + 1] = sample
+
+def reset_history(state):
+    """Clear pitch shifter history so stale input is not mixed into later output"""
+    state.in_fifo.fill(0)
+    state.out_accum.fill(0)
+    state.delay_buf.fill(0)
+
+def process_block(indata, outdata, frames, state):
+    """Real-time audio processing for one duplex stream block"""
+    # Get mono input
+    mono = indata[:, 0]
+    
+    # Output silence while muted (e.g. push-to-talk key not held)
+    if state.muted:
+        reset_history(state)
+        outdata.fill(0)
+        return
+    
+    # Energy gate: skip the effect chain on silent blocks once the hold time
+    # has passed, and clear the (by then near-silent) pitch shifter history
+    if float(np.dot(mono, mono)) >= GATE_ENERGY * frames:
+        state.gate_hold = state.gate_hold_blocks
+    elif state.gate_hold > 0:
+        state.gate_hold -= 1
+    else:
+        reset_history(state)
+        outdata.fill(0)
+        return
+    
+    try:
+        # Pitch shift
+        if abs(state.pitch) > 0.1:
+            if state.pitch_method == 'delay':
+                shifted = pitch_shift_delay(mono, state.pitch, state)
+            else:
+                shifted = pitch_shift_fast(mono, state.pitch, state)
+        else:
+            shifted = mono
+        
+        # Apply robotic effect
+        if state.robotic_enabled:
+            shifted = apply_robotic_effect(shifted, state)
+        
+        # Boost volume, clip and write both output channels in one pass
+        boost_clip_stereo(shifted, outdata, OUTPUT_GAIN, OUTPUT_LIMIT)
+    
+    except Exception as e:
+        # Passthrough on error
+        outdata[:] = mono[:, None] * 1.5
+
+def warm_up():
+    """Compile every kernel once so JIT never runs inside an audio callback"""
+    state = State(block_size=256)
+    indata = np.zeros((256, 1), dtype=np.float32)
+    outdata = np.zeros((256, 2), dtype=np.float32)
+    pitch_shift_delay(indata[:, 0], 3.0, state)
+    shifted = pitch_shift_fast(indata[:, 0], 3.0, state)
+    shifted = apply_robotic_effect(shifted, state)
+    boost_clip_stereo(shifted, outdata, OUTPUT_GAIN, OUTPUT_LIMIT)
+
+warm_up()
@@ -1,13 +1,12 @@
 #!/usr/bin/env python3
 # voice_mod_experimental.py
 # Low latency voice modulator with push-to-talk
-import numpy as np
 import sounddevice as sd
 import sys
 import select
 import termios
 import tty
-from scipy import interpolate
+from voice_mod_dsp import State
 
 # Ultra-low latency settings
 SAMPLE_RATE = 48000
@@ -15,123 +14,10 @@ BLOCK_SIZE = 256  # Minimum for stability
 PITCH_SHIFT = 3.0
 
 # State
-current_pitch = [PITCH_SHIFT]
-robotic_enabled = [True]
+state = State(block_size=BLOCK_SIZE, sample_rate=SAMPLE_RATE, pitch=PITCH_SHIFT)
 push_to_talk_enabled = [False]  # Push-to-talk mode
 is_talking = [False]  # Currently holding talk key
 
-# Pre-compute carrier wave table for robotic effect (optimization)
-carrier_table_size = 4800  # 100ms at 48kHz
-carrier_table = np.sin(2 * np.pi * 95 * np.arange(carrier_table_size) / SAMPLE_RATE).astype(np.float32)
-carrier_idx = [0]
-
-def pitch_shift_fast(audio, semitones):
-    """Fast pitch shift using frequency domain approach"""
-    if abs(semitones) < 0.1:
-        return audio
-    
-    # Calculate pitch ratio
-    ratio = 2.0 ** (semitones / 12.0)
-    
-    # Use FFT to shift frequencies
-    spectrum = np.fft.rfft(audio)
-    freqs = np.fft.rfftfreq(len(audio), 1/SAMPLE_RATE)
-    
-    # Create new spectrum with shifted frequencies
-    new_spectrum = np.zeros_like(spectrum)
-    
-    for i in range(len(spectrum)):
-        # Calculate where this frequency should map to
-        new_freq_idx = int(i / ratio)
-        if 0 <= new_freq_idx < len(new_spectrum):
-            new_spectrum[new_freq_idx] += spectrum[i]
-    
-    # Inverse FFT
-    shifted = np.fft.irfft(new_spectrum, n=len(audio))
-    
-    # Normalize
-    max_val = np.max(np.abs(shifted))
-    if max_val > 0:
-        shifted = shifted / max_val * np.max(np.abs(audio))
-    
-    return shifted.astype(np.float32)
-
-def apply_robotic_effect(audio, intensity=0.7):
-    """Apply robotic effect with pre-computed carrier"""
-    global carrier_idx
-    
-    # Use pre-computed carrier wave for efficiency
-    start_idx = carrier_idx[0]
-    end_idx = start_idx + len(audio)
-    
-    # Wrap around if needed
-    if end_idx <= carrier_table_size:
-        carrier = carrier_table[start_idx:end_idx]
-    else:
-        carrier = np.concatenate([
-            carrier_table[start_idx:],
-            carrier_table[:end_idx - carrier_table_size]
-        ])
-    
-    carrier_idx[0] = end_idx % carrier_table_size
-    
-    # Ring modulation
-    modulated = audio * carrier * intensity + audio * (1 - intensity)
-    
-    # Bit reduction
-    bits = 10
-    modulated = np.round(modulated * (2 ** bits)) / (2 ** bits)
-    
-    # Soft clipping
-    modulated = np.tanh(modulated * 1.2) * 0.9
-    
-    return modulated.astype(np.float32)
-
-def audio_callback(indata, outdata, frames, time_info, status):
-    """Real-time audio processing"""
-    if status:
-        pass  # Ignore status messages for performance
-    
-    # Get mono input
-    mono = indata[:, 0] if indata.shape[1] > 1 else indata.flatten()
-    
-    # Check push-to-talk mode
-    if push_to_talk_enabled[0] and not is_talking[0]:
-        # Mute output when push-to-talk is enabled but key not held
-        outdata[:, 0] = np.zeros(frames, dtype=np.float32)
-        outdata[:, 1] = np.zeros(frames, dtype=np.float32)
-        return
-    
-    try:
-        # Pitch shift
-        if abs(current_pitch[0]) > 0.1:
-            shifted = pitch_shift_fast(mono, current_pitch[0])
-            
-            # Ensure correct length
-            if len(shifted) > frames:
-                shifted = shifted[:frames]
-            elif len(shifted) < frames:
-                shifted = np.pad(shifted, (0, frames - len(shifted)))
-        else:
-            shifted = mono
-        
-        # Apply robotic effect
-        if robotic_enabled[0]:
-            shifted = apply_robotic_effect(shifted, intensity=0.7)
-        
-        # Boost volume
-        shifted = shifted * 2.2
-        shifted = np.clip(shifted, -0.95, 0.95)
-        
-        # Output stereo
-        outdata[:, 0] = shifted
-        outdata[:, 1] = shifted
-        
-    except Exception as e:
-        # Passthrough on error
-        outdata[:, 0] = mono * 1.5
-        outdata[:, 1] = mono * 1.5
-
 def get_key():
     """Non-blocking keyboard input"""
     old_settings = termios.tcgetattr(sys.stdin)
@@ -143,9 +29,13 @@ def get_key():
         termios.tcsetattr(sys.stdin, termios.TCSADRAIN, old_settings)
     return None
 
+def update_mute():
+    """Mute output when push-to-talk is enabled but key not held"""
+    state.muted = push_to_talk_enabled[0] and not is_talking[0]
+
 def print_status():
-    pitch = current_pitch[0]
-    robot_status = "🤖 ON" if robotic_enabled[0] else "OFF"
+    pitch = state.pitch
+    robot_status = "🤖 ON" if state.robotic_enabled else "OFF"
     ptt_status = "PTT: ON" if push_to_talk_enabled[0] else "PTT: OFF"
     talk_status = " [TALKING]" if is_talking[0] else ""
     latency_ms = (BLOCK_SIZE / SAMPLE_RATE) * 1000 * 2.5
@@ -170,7 +60,8 @@ def main():
             samplerate=SAMPLE_RATE,
             blocksize=BLOCK_SIZE,
             channels=(1, 2),
-            callback=audio_callback,
+            dtype='float32',
+            callback=state.callback,
             latency=0.005,  # Request 5ms latency explicitly
             prime_output_buffers_using_stream_callback=False
         ):
@@ -182,35 +73,37 @@ def main():
                         print("\n\nStopping...")
                         break
                     elif key == 'r' or key == 'R':
-                        robotic_enabled[0] = not robotic_enabled[0]
+                        state.robotic_enabled = not state.robotic_enabled
                         print_status()
                     elif key == 'p' or key == 'P':
                         push_to_talk_enabled[0] = not push_to_talk_enabled[0]
                         if not push_to_talk_enabled[0]:
                             is_talking[0] = False  # Reset talk state
+                        update_mute()
                         print_status()
                     elif key == ' ':  # Spacebar
                         if push_to_talk_enabled[0]:
                             is_talking[0] = not is_talking[0]  # Toggle on space
+                            update_mute()
                             print_status()
                     elif key == '+' or key == '=':
-                        current_pitch[0] += 0.5
+                        state.pitch += 0.5
                         print_status()
                     elif key == '-' or key == '_':
-                        current_pitch[0] -= 0.5
+                        state.pitch -= 0.5
                         print_status()
                     elif key == '0':
-                        current_pitch[0] = PITCH_SHIFT
+                        state.pitch = PITCH_SHIFT
                         print_status()
                     elif key == '\x1b':
                         next1 = get_key()
                         next2 = get_key()
                         if next1 == '[':
                             if next2 == 'A':
-                                current_pitch[0] += 0.5
+                                state.pitch += 0.5
                                 print_status()
                             elif next2 == 'B':
-                                current_pitch[0] -= 0.5
+                                state.pitch -= 0.5
                                 print_status()
                 
     except KeyboardInterrupt: